@@ -1,178 +1,489 @@
-import os
-import asyncio
-import aiohttp
-import aiofiles
-import json
-from urllib.parse import urlparse, unquote
-
-# --- Settings ---
-BASE_DOWNLOAD_FOLDER = "TFM_DOWNLOADED_ASSETS"  # Main folder to save everything
-USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.0.0 Safari/537.36" # Standard User-Agent
-
-async def download_item(session: aiohttp.ClientSession, url: str, base_folder: str):
-    """
-    Downloads a single item (file) from a URL and saves it locally,
-    creating necessary directories.
-    """
-    local_filepath = "N/A" # Initialize for error reporting
-    try:
-        print(f"[INFO] Processing URL: {url}")
-        async with session.get(url) as resp:
-            if resp.status == 200:
-                content_to_write = await resp.read()
-
-                # --- Improved Path Handling ---
-                parsed_url = urlparse(url)
-                # Remove any query parameters from the path to get the correct filename/folder structure
-                path_without_query = unquote(parsed_url.path.split('?')[0])
-
-                # Remove leading slash if present to ensure os.path.join works correctly
-                if path_without_query.startswith('/'):
-                    path_without_query = path_without_query[1:]
-
-                # Construct the full local filepath
-                # Example: base_folder = "TFM_DOWNLOADED_ASSETS"
-                # path_without_query = "images/maps/map1.png"
-                # local_filepath = "TFM_DOWNLOADED_ASSETS/images/maps/map1.png"
-                local_filepath = os.path.join(base_folder, path_without_query)
-
-                # Create parent directories for the file if they don't exist
-                local_dir = os.path.dirname(local_filepath)
-                if not os.path.exists(local_dir):
-                    print(f"[+] Creating directory: {local_dir}")
-                    os.makedirs(local_dir, exist_ok=True)
-                # --- End of Improved Path Handling ---
-
-                # Check if file exists and content matches (can be simplified if not needed)
-                if os.path.exists(local_filepath):
-                    try:
-                        async with aiofiles.open(local_filepath, mode='rb') as f_existing:
-                            existing_content = await f_existing.read()
-                        if existing_content == content_to_write:
-                            print(f"[SKIP] File '{local_filepath}' already exists and content matches, skipping.")
-                            return
-                        else:
-                            print(f"[WARN] File '{local_filepath}' exists but content differs. Overwriting.")
-                    except Exception as e_read:
-                        print(f"[WARN] Could not read existing file '{local_filepath}' for comparison: {e_read}. Overwriting.")
-
-                async with aiofiles.open(local_filepath, mode='wb') as f:
-                    await f.write(content_to_write)
-                print(f"[SAVE] Saved '{os.path.basename(local_filepath)}' to '{local_dir}/'")
-
-            elif resp.status == 404:
-                print(f"[ERROR] File not found (404): {url}")
-            else:
-                print(f"[ERROR] Failed to download {url}. Status: {resp.status}")
-
-    except aiohttp.ClientError as e:
-        print(f"[NETWORK_ERROR] Could not connect or download {url}: {e}")
-    except OSError as e:
-        print(f"[OS_ERROR] Filesystem error for {url} (path: {local_filepath}): {e}")
-    except Exception as e:
-        print(f"[UNEXPECTED_ERROR] Downloading {url}: {e}")
-        import traceback
-        traceback.print_exc() # Print full traceback for unexpected errors
-
-
-async def start_downloads():
-    print('[+] Transformice Asset Downloader')
-    print('[+] Using combined list and direct downloads.')
-    print(f'[+] Files will be saved to: {os.path.abspath(BASE_DOWNLOAD_FOLDER)}')
-    print()
-
-    # Create the base download directory if it doesn't exist
-    if not os.path.exists(BASE_DOWNLOAD_FOLDER):
-        os.makedirs(BASE_DOWNLOAD_FOLDER)
-        print(f"[INFO] Created base download directory: {BASE_DOWNLOAD_FOLDER}")
-
-    tasks = []
-    # Add a User-Agent to the session
-    async with aiohttp.ClientSession(headers={'User-Agent': USER_AGENT}) as session:
-        # 1. Download from derpolino list (as in the original code)
-        print("\n--- Fetching file list from derpolino.alwaysdata.net ---")
-        derpolino_urls_to_download = []
-        # These paths should be what getFiles.php expects for the 'n' parameter
-        paths_for_derpolino = ['images', 'ar', 'godspaw', 'share', 'woot', 'wp-admin', 'wp-content', 'wp-includes']
-        for html_path_segment in paths_for_derpolino:
-            # Ensure the path segment is URL-encoded for the 'n' parameter
-            php_url = f"http://derpolino.alwaysdata.net/imagetfm/getFiles.php?n={html_path_segment}%2F&mode=tfm"
-            print(f"[INFO] Fetching from {php_url}")
-            try:
-                async with session.get(php_url) as resp:
-                    if resp.status == 200:
-                        content = await resp.read()
-                        try:
-                            # Assuming json.loads(...).values() gives a list of *path segments*
-                            # that need "https://www.transformice.com/" prepended.
-                            # Or it might give full URLs. We'll try to handle both.
-                            data = json.loads(content.decode(errors='ignore'))
-                            if isinstance(data, dict):
-                                partial_urls = data.values()
-                            elif isinstance(data, list): # If it's already a list of URLs/paths
-                                partial_urls = data
-                            else:
-                                print(f"[ERROR] Unexpected JSON structure from {php_url}. Expected dict or list, got {type(data)}")
-                                partial_urls = []
-
-                            for p_url in partial_urls:
-                                if not isinstance(p_url, str): # Skip if not a string URL/path
-                                    print(f"[WARN] Non-string item in derpolino list: {p_url}. Skipping.")
-                                    continue
-                                if not p_url.startswith(('http://', 'https://')):
-                                    full_url = f'https://www.transformice.com/{p_url.lstrip("/")}'
-                                else:
-                                    full_url = p_url  # If derpolino already provides a full URL
-                                derpolino_urls_to_download.append(full_url)
-                        except json.JSONDecodeError:
-                            print(f"[ERROR] Could not decode JSON from {php_url}. Content (first 200 chars): {content[:200]}")
-                        except Exception as e:
-                            print(f"[ERROR] Error processing response from {php_url}: {e}")
-                    else:
-                        print(f"[ERROR] Failed to fetch from {php_url}. Status: {resp.status}")
-            except Exception as e:
-                print(f"[ERROR] Could not connect to or process {php_url}: {e}")
-
-        for url in derpolino_urls_to_download:
-            tasks.append(download_item(session, url, BASE_DOWNLOAD_FOLDER))
-        print(f"--- Added {len(derpolino_urls_to_download)} URLs from derpolino for download ---")
-
-        # 2. Download specific SWF files from x_bibliotheques
-        print("\n--- Downloading specific SWF files from x_bibliotheques ---")
-        bibliotheques_base = 'http://transformice.com/images/x_bibliotheques/'
-        for binary in ["x_fourrures", "x_fourrures2", "x_fourrures3", "x_fourrures4", "x_meli_costumes", "x_pictos_editeur"]:
-            tasks.append(download_item(session, f'{bibliotheques_base}{binary}.swf', BASE_DOWNLOAD_FOLDER))
-
-        # 3. Download language files
-        print("\n--- Downloading language files (tfz) ---")
-        langues_base = 'http://transformice.com/langues/'
-        # Note: these are likely binary files, not SWFs. The original code implies this.
-        for langue in ['en', 'fr', 'br', 'es', 'cn', 'tr', 'vk', 'pl', 'hu', 'nl', 'ro', 'id', 'de', 'e2', 'ar', 'ph', 'lt', 'jp', 'ch', 'fi', 'cz', 'sk', 'hr', 'bu', 'lv', 'he', 'it', 'et', 'az', 'pt']:
-            tasks.append(download_item(session, f'{langues_base}tfz_{langue}', BASE_DOWNLOAD_FOLDER))
-
-        # 4. Download music files
-        print("\n--- Downloading music files ---")
-        musiques_base = 'http://transformice.com/images/musiques/'
-        for music_num in range(4):  # 0, 1, 2, 3
-            tasks.append(download_item(session, f'{musiques_base}tfm_{music_num}.mp3', BASE_DOWNLOAD_FOLDER))
-
-        # Execute all download tasks concurrently
-        if tasks:
-            print(f"\n[INFO] Starting download of {len(tasks)} items...")
-            await asyncio.gather(*tasks)
-        else:
-            print("[INFO] No items found to download from the specified lists.")
-
-    print('\n--- Download process finished ---')
-    input("Press Enter to exit...") # Cross-platform way to pause
-
-async def main():
-    # For Python 3.7+ you can use asyncio.run() directly
-    await start_downloads()
-
-if __name__ == "__main__":
-    # On Windows, you might need this policy if you encounter issues with asyncio
-    # especially in certain environments or older Python 3 versions.
-    # if os.name == 'nt':
-    # asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    asyncio.run(main()) # Modern way to run asyncio (Python 3.7+)
\ No newline at end of file
+import os
+import sys
+import asyncio
+import socket
+import aiohttp
+from aiohttp.resolver import AsyncResolver  # non-blocking DNS via aiodns
+from aiofile import async_open  # libaio-backed on Linux; no thread-pool hop per write
+import hashlib
+import json
+import logging
+import mmap
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+from urllib.parse import urlparse, unquote
+
+# orjson parses the derpolino listings a few times faster than the stdlib;
+# its JSONDecodeError subclasses json.JSONDecodeError so error handling is
+# unchanged. Fall back silently if it's not installed.
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# --- Settings ---
+BASE_DOWNLOAD_FOLDER = "TFM_DOWNLOADED_ASSETS"  # Main folder to save everything
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.0.0 Safari/537.36" # Standard User-Agent
+CONNECTOR_LIMIT = 32           # Total simultaneous connections for the whole session
+CONNECTOR_LIMIT_PER_HOST = 10  # Most URLs hit transformice.com; don't hammer a single host
+MAX_CONCURRENT_DOWNLOADS = 10  # Semaphore gate so we don't fire hundreds of requests at once
+MAX_CONCURRENT_SMALL_DOWNLOADS = 4  # Separate lane for the ~40 direct tfz/mp3/swf downloads
+MANIFEST_FILENAME = "manifest.json"  # Maps url -> {etag, last_modified, sha256, size} for skip checks
+RETRY_ATTEMPTS = 5  # Total tries per URL before giving up on transient failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}  # Server responses worth retrying
+RETRY_BASE_DELAY = 0.5  # Seconds; doubled per attempt when no Retry-After is given
+URL_PREFIXES = ('http://', 'https://')  # Listing entries starting with these are already full URLs
+TRANSFORMICE_BASE = 'https://www.transformice.com/'  # Prepended to bare listing paths
+DOWNLOAD_CHUNK_SIZE = 1 << 16  # 64 KiB chunks when streaming response bodies to disk
+
+# Directories already created this run. Hundreds of URLs share a handful of
+# subtrees, so checking this set avoids a stat+mkdir syscall per download.
+# Single-threaded event loop + GIL make plain set operations safe here.
+_created_dirs = set()
+
+log = logging.getLogger("tfm_downloader")
+
+
+def setup_logging() -> QueueListener:
+    """
+    Routes all log records through a queue to a background listener thread.
+    The coroutines only enqueue records; the blocking stdout writes happen
+    off the event loop, so heavy logging no longer serializes the downloads.
+    """
+    log_queue = queue.SimpleQueue()
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('%(message)s'))
+    listener = QueueListener(log_queue, console)
+    logging.basicConfig(handlers=[QueueHandler(log_queue)], level=logging.INFO)
+    listener.start()
+    return listener
+
+
+def load_manifest(base_folder: str) -> dict:
+    """Loads the download manifest from a previous run, or returns an empty one."""
+    manifest_path = os.path.join(base_folder, MANIFEST_FILENAME)
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            log.warning(f"[WARN] Could not read manifest '{manifest_path}': {e}. Starting fresh.")
+    return {}
+
+
+def save_manifest(base_folder: str, manifest: dict):
+    """Persists the download manifest so the next run can skip unchanged files."""
+    manifest_path = os.path.join(base_folder, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        log.info(f"[INFO] Saved manifest with {len(manifest)} entries to '{manifest_path}'")
+    except OSError as e:
+        log.warning(f"[WARN] Could not save manifest '{manifest_path}': {e}")
+
+
+def _hash_file_mmap(path: str) -> str:
+    """
+    SHA-256 of an existing file, read through mmap so the kernel page cache
+    backs the bytes instead of a file-sized allocation. Blocking; run it in
+    a thread from coroutine code.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        if os.fstat(fp.fileno()).st_size > 0:  # mmap rejects empty files
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                h.update(mm)
+    return h.hexdigest()
+
+
+def _create_dirs_for(local_paths) -> None:
+    """
+    Creates the unique parent directories for a batch of local filepaths in
+    one pass, sorted so parents precede children, skipping any already made
+    this run. Blocking; call via asyncio.to_thread. Batching here lets the
+    download coroutines assume their target directory exists.
+    """
+    for d in sorted({os.path.dirname(p) for p in local_paths} - _created_dirs):
+        os.makedirs(d, exist_ok=True)
+        _created_dirs.add(d)
+
+
+def url_to_local_path(url: str, base_folder: str) -> str:
+    """
+    Maps a download URL to its local filepath under base_folder, mirroring
+    the URL's path structure. Called once per URL at enqueue time so the
+    workers never repeat the parse/unquote/join string work.
+
+    Example: base_folder = "TFM_DOWNLOADED_ASSETS"
+             url path    = "/images/maps/map1.png"
+             result      = "TFM_DOWNLOADED_ASSETS/images/maps/map1.png"
+    """
+    parsed_url = urlparse(url)
+    # Remove any query parameters from the path to get the correct filename/folder structure
+    path_without_query = unquote(parsed_url.path.split('?')[0])
+
+    # Remove leading slash if present to ensure os.path.join works correctly
+    if path_without_query.startswith('/'):
+        path_without_query = path_without_query[1:]
+
+    return os.path.join(base_folder, path_without_query)
+
+
+async def fetch_listing(session: aiohttp.ClientSession, html_path_segment: str, queue: asyncio.Queue, base_folder: str) -> int:
+    """
+    Fetches one derpolino getFiles.php listing and enqueues (url, local_filepath)
+    pairs for the download URLs it contains, returning how many were enqueued.
+    Feeding the queue as URLs arrive lets the download workers start before
+    every listing is in. Errors are logged and yield zero URLs so one bad
+    listing never blocks the others.
+    """
+    # Ensure the path segment is URL-encoded for the 'n' parameter
+    php_url = f"http://derpolino.alwaysdata.net/imagetfm/getFiles.php?n={html_path_segment}%2F&mode=tfm"
+    log.info(f"[INFO] Fetching from {php_url}")
+    enqueued = 0
+    try:
+        async with session.get(php_url) as resp:
+            if resp.status == 200:
+                try:
+                    # content_type=None because the PHP endpoint doesn't send an
+                    # application/json header. resp.json() streams, detects the
+                    # encoding and parses in one step, skipping the intermediate
+                    # bytes object and manual .decode of read()+json.loads.
+                    # Assuming the parsed dict's .values() gives a list of *path
+                    # segments* that need "https://www.transformice.com/"
+                    # prepended. Or it might give full URLs. We'll try to handle both.
+                    data = await resp.json(content_type=None, loads=_json_loads)
+                    if isinstance(data, dict):
+                        partial_urls = data.values()
+                    elif isinstance(data, list): # If it's already a list of URLs/paths
+                        partial_urls = data
+                    else:
+                        log.error(f"[ERROR] Unexpected JSON structure from {php_url}. Expected dict or list, got {type(data)}")
+                        partial_urls = []
+
+                    str_urls = [p for p in partial_urls if isinstance(p, str)]
+                    if len(str_urls) != len(partial_urls):  # Skip non-string URLs/paths
+                        log.warning(f"[WARN] Dropped {len(partial_urls) - len(str_urls)} non-string item(s) from derpolino list.")
+                    # Normalize in one comprehension with the prefix tuple and
+                    # base hoisted to module constants -- listings can run to
+                    # thousands of entries, so keep the per-item work minimal.
+                    full_urls = [
+                        p if p.startswith(URL_PREFIXES) else TRANSFORMICE_BASE + p.lstrip('/')
+                        for p in str_urls
+                    ]
+                    pairs = [(u, url_to_local_path(u, base_folder)) for u in full_urls]
+                    # Create this batch's directory tree in one pass before any
+                    # worker touches the files; download_item relies on it.
+                    await asyncio.to_thread(_create_dirs_for, [p for _, p in pairs])
+                    for pair in pairs:
+                        await queue.put(pair)
+                    enqueued += len(pairs)
+                except json.JSONDecodeError:
+                    log.error(f"[ERROR] Could not decode JSON from {php_url}.")
+                except Exception as e:
+                    log.error(f"[ERROR] Error processing response from {php_url}: {e}")
+            else:
+                log.error(f"[ERROR] Failed to fetch from {php_url}. Status: {resp.status}")
+    except Exception as e:
+        log.error(f"[ERROR] Could not connect to or process {php_url}: {e}")
+    return enqueued
+
+
+async def download_worker(session: aiohttp.ClientSession, queue: asyncio.Queue, sem: asyncio.Semaphore, manifest: dict):
+    """
+    Pulls (url, local_filepath) pairs off the queue and downloads them until
+    it receives the None sentinel. Running a fixed pool of these instead of
+    one task per URL keeps memory bounded regardless of how many URLs the
+    listings produce.
+    """
+    while True:
+        item = await queue.get()
+        if item is None:  # sentinel: producers are done, shut down
+            break
+        url, local_filepath = item
+        await download_item(session, url, local_filepath, sem, manifest)
+
+
+async def download_item(session: aiohttp.ClientSession, url: str, local_filepath: str, sem: asyncio.Semaphore, manifest: dict):
+    """
+    Downloads a single item (file) from a URL and saves it to the
+    precomputed local_filepath, creating necessary directories.
+    """
+    try:
+        log.info(f"[INFO] Processing URL: {url}")
+
+        entry = manifest.get(url)
+        # One stat per URL, run in a thread so a slow filesystem can't stall
+        # the event loop; the result is reused by every branch below.
+        file_exists = await asyncio.to_thread(os.path.exists, local_filepath)
+        request_headers = {}
+        if entry and file_exists:
+            # Conditional GET: send back the validators recorded on a previous
+            # run. If the file is unchanged the server answers 304 with no
+            # body, so a re-run costs one round trip and zero transfer --
+            # cheaper than a separate HEAD check followed by a full GET.
+            if entry.get('etag'):
+                request_headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                request_headers['If-Modified-Since'] = entry['last_modified']
+
+        # Gate the actual request so only a bounded number of downloads run at once.
+        # Without this, gather() fires every task immediately and the server
+        # rate-limits or resets connections. Transient server errors (429/5xx)
+        # are retried with exponential backoff instead of dropping the URL.
+        for attempt in range(RETRY_ATTEMPTS):
+            try:
+                async with sem, session.get(url, headers=request_headers) as resp:
+                    if resp.status in RETRY_STATUSES and attempt < RETRY_ATTEMPTS - 1:
+                        # Honor an explicit Retry-After if the server sends one,
+                        # otherwise back off exponentially with a little jitter.
+                        retry_after = resp.headers.get('Retry-After')
+                        if retry_after and retry_after.isdigit():
+                            delay = int(retry_after)
+                        else:
+                            delay = RETRY_BASE_DELAY * (2 ** attempt) + random.uniform(0, 0.5)
+                        log.warning(f"[WARN] Got {resp.status} for {url}; retrying in {delay:.1f}s (attempt {attempt + 1}/{RETRY_ATTEMPTS}).")
+                    elif resp.status == 304:
+                        log.info(f"[SKIP] '{local_filepath}' unchanged on server (304 Not Modified), skipping download.")
+                        return
+                    elif resp.status == 200:
+                        # Parent directories were batch-created by the producer
+                        # (see _create_dirs_for), so this coroutine goes straight
+                        # to writing.
+                        # Stream the body straight to a temp file in fixed-size chunks
+                        # instead of buffering multi-MB SWFs/MP3s in memory, hashing
+                        # each chunk as it arrives so the manifest compare still works.
+                        tmp_filepath = local_filepath + '.part'
+                        hasher = hashlib.sha256()
+                        bytes_written = 0
+                        async with async_open(tmp_filepath, 'wb') as f:
+                            async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                                hasher.update(chunk)
+                                bytes_written += len(chunk)
+                                await f.write(chunk)
+
+                        new_sha256 = hasher.hexdigest()
+                        new_entry = {
+                            'etag': resp.headers.get('ETag'),
+                            'last_modified': resp.headers.get('Last-Modified'),
+                            'sha256': new_sha256,
+                            'size': bytes_written,
+                        }
+
+                        # Compare against the hash recorded in the manifest instead of
+                        # re-reading the existing file from disk.
+                        if entry and entry.get('sha256') == new_sha256 and file_exists:
+                            log.info(f"[SKIP] File '{local_filepath}' already exists and content matches, skipping.")
+                            await asyncio.to_thread(os.remove, tmp_filepath)
+                            manifest[url] = new_entry  # refresh validators for the next run
+                            return
+                        elif not entry and file_exists:
+                            # File predates the manifest (e.g. downloaded by an older
+                            # version of this script): hash it through mmap in a thread
+                            # and compare digests, rather than reading it into memory.
+                            try:
+                                existing_sha256 = await asyncio.to_thread(_hash_file_mmap, local_filepath)
+                            except OSError as e_hash:
+                                log.warning(f"[WARN] Could not hash existing file '{local_filepath}': {e_hash}. Overwriting.")
+                                existing_sha256 = None
+                            if existing_sha256 == new_sha256:
+                                log.info(f"[SKIP] File '{local_filepath}' already exists and content matches, skipping.")
+                                await asyncio.to_thread(os.remove, tmp_filepath)
+                                manifest[url] = new_entry  # adopt the file into the manifest
+                                return
+                        elif entry and file_exists:
+                            log.warning(f"[WARN] File '{local_filepath}' exists but content differs. Overwriting.")
+
+                        # Atomic publish: a crash mid-download leaves only a .part file,
+                        # never a truncated asset at the final path. The rename runs in
+                        # a thread so a slow filesystem can't stall the event loop.
+                        await asyncio.to_thread(os.replace, tmp_filepath, local_filepath)
+                        manifest[url] = new_entry
+                        log.info(f"[SAVE] Saved '{os.path.basename(local_filepath)}' to '{os.path.dirname(local_filepath)}/'")
+                        return
+
+                    elif resp.status == 404:
+                        log.error(f"[ERROR] File not found (404): {url}")
+                        return
+                    else:
+                        log.error(f"[ERROR] Failed to download {url}. Status: {resp.status}")
+                        return
+            except asyncio.TimeoutError:
+                # Stalled connection: the session ClientTimeout fired. Retry
+                # like a transient server error rather than losing the URL.
+                if attempt < RETRY_ATTEMPTS - 1:
+                    delay = RETRY_BASE_DELAY * (2 ** attempt) + random.uniform(0, 0.5)
+                    log.warning(f"[WARN] Timeout for {url}; retrying in {delay:.1f}s (attempt {attempt + 1}/{RETRY_ATTEMPTS}).")
+                else:
+                    log.error(f"[ERROR] Timed out downloading {url} after {RETRY_ATTEMPTS} attempts.")
+                    return
+
+            # Sleep outside the semaphore/connection so the backoff doesn't
+            # hold a download slot or keep the response open.
+            await asyncio.sleep(delay)
+
+    except aiohttp.ClientError as e:
+        log.error(f"[NETWORK_ERROR] Could not connect or download {url}: {e}")
+    except OSError as e:
+        log.error(f"[OS_ERROR] Filesystem error for {url} (path: {local_filepath}): {e}")
+    except Exception as e:
+        # log.exception attaches the full traceback for unexpected errors
+        log.exception(f"[UNEXPECTED_ERROR] Downloading {url}: {e}")
+
+
+async def start_downloads():
+    log.info('[+] Transformice Asset Downloader')
+    log.info('[+] Using combined list and direct downloads.')
+    log.info(f'[+] Files will be saved to: {os.path.abspath(BASE_DOWNLOAD_FOLDER)}')
+    log.info("")
+
+    # Create the base download directory if it doesn't exist
+    if not os.path.exists(BASE_DOWNLOAD_FOLDER):
+        os.makedirs(BASE_DOWNLOAD_FOLDER)
+        log.info(f"[INFO] Created base download directory: {BASE_DOWNLOAD_FOLDER}")
+
+    # Manifest of what previous runs downloaded; lets download_item skip
+    # unchanged files without re-reading them from disk.
+    manifest = load_manifest(BASE_DOWNLOAD_FOLDER)
+    if manifest:
+        log.info(f"[INFO] Loaded manifest with {len(manifest)} entries from a previous run.")
+
+    # Bound the connection pool and gate concurrent downloads with a semaphore.
+    # The URL queue below easily reaches hundreds of entries; without these
+    # limits they would all race for sockets at once.
+    # Keepalive settings matter here: nearly every URL targets transformice.com,
+    # so reusing warm connections avoids a TCP/TLS handshake per file.
+    # AsyncResolver (backed by aiodns) plus a long DNS cache TTL means the
+    # three hosts involved are each resolved once and shared by every task.
+    try:
+        resolver = AsyncResolver()
+    except Exception as e_resolver:  # aiodns not installed / c-ares unavailable
+        log.warning(f"[WARN] AsyncResolver unavailable ({e_resolver}); using default threaded resolver.")
+        resolver = None
+    connector = aiohttp.TCPConnector(
+        limit=CONNECTOR_LIMIT,
+        limit_per_host=CONNECTOR_LIMIT_PER_HOST,
+        resolver=resolver,
+        use_dns_cache=True,
+        ttl_dns_cache=600,
+        family=socket.AF_INET,
+        keepalive_timeout=75,
+        force_close=False,
+        enable_cleanup_closed=True,
+    )
+    # Accept-Encoding lets aiohttp transparently decompress the textual
+    # tfz_* language files the server can gzip.
+    session_headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip, deflate'}
+    # Explicit timeouts: a stalled CDN connection would otherwise hang its
+    # worker (and semaphore slot) forever. Timeouts surface as
+    # asyncio.TimeoutError in download_item, which retries them.
+    timeout = aiohttp.ClientTimeout(total=60, connect=10, sock_read=20)
+    async with aiohttp.ClientSession(connector=connector, headers=session_headers, timeout=timeout) as session:
+        # Two workload classes, each with its own queue, semaphore and worker
+        # pool: the ~40 direct downloads (tfz/mp3/swf) get their own lane so
+        # they finish early instead of queueing behind hundreds of bulk image
+        # URLs. TaskGroup gives structured cancellation -- a failing worker
+        # cancels the group instead of gather() swallowing the exception.
+        bulk_queue = asyncio.Queue()
+        small_queue = asyncio.Queue()
+        bulk_sem = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+        small_sem = asyncio.Semaphore(MAX_CONCURRENT_SMALL_DOWNLOADS)
+        total_enqueued = 0
+
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(MAX_CONCURRENT_DOWNLOADS):
+                tg.create_task(download_worker(session, bulk_queue, bulk_sem, manifest))
+            for _ in range(MAX_CONCURRENT_SMALL_DOWNLOADS):
+                tg.create_task(download_worker(session, small_queue, small_sem, manifest))
+
+            # The direct downloads are enqueued first, smallest class first
+            # (tfz < mp3 < swf), so the small lane starts immediately while
+            # the listings are still in flight.
+            direct_downloads = []
+
+            # 1. Download language files
+            log.info("\n--- Downloading language files (tfz) ---")
+            langues_base = 'http://transformice.com/langues/'
+            # Note: these are likely binary files, not SWFs. The original code implies this.
+            for langue in ['en', 'fr', 'br', 'es', 'cn', 'tr', 'vk', 'pl', 'hu', 'nl', 'ro', 'id', 'de', 'e2', 'ar', 'ph', 'lt', 'jp', 'ch', 'fi', 'cz', 'sk', 'hr', 'bu', 'lv', 'he', 'it', 'et', 'az', 'pt']:
+                langue_url = f'{langues_base}tfz_{langue}'
+                direct_downloads.append((langue_url, url_to_local_path(langue_url, BASE_DOWNLOAD_FOLDER)))
+
+            # 2. Download music files
+            log.info("\n--- Downloading music files ---")
+            musiques_base = 'http://transformice.com/images/musiques/'
+            for music_num in range(4):  # 0, 1, 2, 3
+                music_url = f'{musiques_base}tfm_{music_num}.mp3'
+                direct_downloads.append((music_url, url_to_local_path(music_url, BASE_DOWNLOAD_FOLDER)))
+
+            # 3. Download specific SWF files from x_bibliotheques
+            log.info("\n--- Downloading specific SWF files from x_bibliotheques ---")
+            bibliotheques_base = 'http://transformice.com/images/x_bibliotheques/'
+            for binary in ["x_fourrures", "x_fourrures2", "x_fourrures3", "x_fourrures4", "x_meli_costumes", "x_pictos_editeur"]:
+                swf_url = f'{bibliotheques_base}{binary}.swf'
+                direct_downloads.append((swf_url, url_to_local_path(swf_url, BASE_DOWNLOAD_FOLDER)))
+
+            # One upfront pass creates every directory the direct downloads
+            # need, then the pairs go onto the small lane.
+            await asyncio.to_thread(_create_dirs_for, [p for _, p in direct_downloads])
+            for pair in direct_downloads:
+                await small_queue.put(pair)
+            total_enqueued += len(direct_downloads)
+
+            # 4. Download from derpolino list (as in the original code)
+            log.info("\n--- Fetching file list from derpolino.alwaysdata.net ---")
+            # These paths should be what getFiles.php expects for the 'n' parameter
+            paths_for_derpolino = ['images', 'ar', 'godspaw', 'share', 'woot', 'wp-admin', 'wp-content', 'wp-includes']
+            # Fetch all listings concurrently instead of one round-trip at a time;
+            # fetch_listing handles its own errors, return_exceptions is belt-and-braces.
+            listing_counts = await asyncio.gather(
+                *(fetch_listing(session, segment, bulk_queue, BASE_DOWNLOAD_FOLDER) for segment in paths_for_derpolino),
+                return_exceptions=True,
+            )
+            derpolino_count = 0
+            for segment, count in zip(paths_for_derpolino, listing_counts):
+                if isinstance(count, BaseException):
+                    log.error(f"[ERROR] Listing for '{segment}' failed: {count}")
+                    continue
+                derpolino_count += count
+            total_enqueued += derpolino_count
+            log.info(f"--- Enqueued {derpolino_count} URLs from derpolino for download ---")
+
+            # All producers are done: send one sentinel per worker; the
+            # TaskGroup waits for every worker to drain its queue and exit.
+            log.info(f"\n[INFO] Enqueued {total_enqueued} items in total; waiting for downloads to finish...")
+            for _ in range(MAX_CONCURRENT_DOWNLOADS):
+                bulk_queue.put_nowait(None)
+            for _ in range(MAX_CONCURRENT_SMALL_DOWNLOADS):
+                small_queue.put_nowait(None)
+
+    # Persist what we learned this run so the next run can skip unchanged files.
+    save_manifest(BASE_DOWNLOAD_FOLDER, manifest)
+
+    log.info('\n--- Download process finished ---')
+    input("Press Enter to exit...") # Cross-platform way to pause
+
+async def main():
+    # For Python 3.7+ you can use asyncio.run() directly
+    await start_downloads()
+
+if __name__ == "__main__":
+    # On Windows, you might need this policy if you encounter issues with asyncio
+    # especially in certain environments or older Python 3 versions.
+    # if os.name == 'nt':
+    # asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    if sys.platform != 'win32':
+        # uvloop (libuv-backed event loop) noticeably speeds up runs with
+        # hundreds of concurrent sockets; fall back silently if not installed.
+        try:
+            import uvloop
+            uvloop.install()
+        except ImportError:
+            pass
+    listener = setup_logging()
+    try:
+        asyncio.run(main()) # Modern way to run asyncio (Python 3.7+)
+    finally:
+        listener.stop()  # flush any queued log records before exiting
\ No newline at end of file